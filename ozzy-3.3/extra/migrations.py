@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+migrations.py
+~~~~~~~~~~~~~
+
+Migration check for the files index. A database is created with the
+schema of each former version of the plugin, including file names that
+the former 'string' columns store as numbers, and is then opened with
+the current code. The check fails if the database is not brought up to
+the current schema or if any record is lost or altered on the way.
+
+Usage: python migrations.py
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugin'))
+
+import ozzy.db
+
+
+NAMES = [u'123', u'2048', u'1e5', u'007', u'0x1f', u'util.py',
+         u'Été.txt', u'README']
+
+# schema of each former version, along with a record for the given path,
+# file name and frequency
+VERSIONS = {
+    0: ("""CREATE TABLE files_index (
+               path string primary key,
+               fname string not null,
+               frequency integer not null,
+               last_access timestamp not null
+           );""",
+        lambda path, fname, freq: (path, fname, freq, '2013-06-24 10:00:00')),
+    1: ("""CREATE TABLE files_index (
+               path string primary key,
+               fname string not null,
+               frequency integer not null,
+               last_access integer not null
+           );
+           PRAGMA user_version = 1;""",
+        lambda path, fname, freq: (path, fname, freq, 1372068000)),
+    2: ("""CREATE TABLE files_index (
+               path string primary key,
+               fname string not null,
+               fname_fold string not null,
+               frequency integer not null,
+               last_access integer not null
+           );
+           PRAGMA user_version = 2;""",
+        lambda path, fname, freq: (path, fname, fname.lower(), freq,
+                                   1372068000)),
+}
+
+
+def check(version, top):
+    """To migrate a database created with the given schema version and
+    return the list of problems found."""
+    schema, record = VERSIONS[version]
+    db_path = os.path.join(top, 'index{0}.db'.format(version))
+    expected = {}
+
+    conn = sqlite3.connect(db_path)
+    conn.executescript(schema)
+    for i, name in enumerate(NAMES):
+        path = os.path.join(top, 'dir{0}'.format(i % 3), name)
+        expected[path] = i + 1
+        values = record(path, name, i + 1)
+        conn.execute("INSERT INTO files_index VALUES ({0})".format(
+            ", ".join("?" * len(values))), values)
+    conn.commit()
+    conn.close()
+
+    problems = []
+    try:
+        db = ozzy.db.DBProxy(db_path)
+    except sqlite3.Error as e:
+        return ['cannot open the database: {0}'.format(e)]
+
+    current = db.conn.execute("PRAGMA user_version").fetchone()[0]
+    if current != db.SCHEMA_VERSION:
+        problems.append('schema version {0} instead of {1}'.format(
+            current, db.SCHEMA_VERSION))
+
+    rows = dict((r.path, r) for r in db.all())
+    for path, frequency in sorted(expected.items()):
+        r = rows.get(path)
+        if r is None:
+            problems.append(u'missing {0}'.format(path))
+        elif r.fname != os.path.basename(path):
+            problems.append(u'file name {0!r} for {1}'.format(r.fname, path))
+        elif r.frequency != frequency:
+            problems.append(u'frequency {0} for {1}'.format(
+                r.frequency, path))
+        elif not r.last_access:
+            problems.append(u'no last access time for {0}'.format(path))
+    if len(rows) != len(expected):
+        problems.append('{0} records instead of {1}'.format(
+            len(rows), len(expected)))
+
+    for name in NAMES:
+        found = [r.path for r in db.get(name, case_sensitive=True)]
+        if not any(os.path.basename(p) == name for p in found):
+            problems.append(u'{0} cannot be found'.format(name))
+
+    db.close()
+    return problems
+
+
+def main():
+    top = tempfile.mkdtemp(prefix=u'ozzy-migrations-')
+    try:
+        failed = False
+        for version in sorted(VERSIONS):
+            problems = check(version, top)
+            status = 'ok' if not problems else 'FAILED'
+            print "from version {0}: {1}".format(version, status)
+            for problem in problems:
+                print u"    {0}".format(problem).encode('utf-8')
+            failed = failed or bool(problems)
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(top, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+stress.py
+~~~~~~~~~
+
+Concurrency stress harness for the files index. Several processes, each
+one playing the part of a Vim instance, hammer the same index.db with
+file updates and queries. At the end the harness reports the throughput,
+the time spent waiting for locks, the retries and failures counted by
+the database proxy and the updates that have been lost.
+
+Usage: python stress.py [--processes N] [--seconds S] [--files F]
+                        [--busy-timeout MS] [--retries R] [--db PATH]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import optparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugin'))
+
+import ozzy.engine
+
+
+SEEDS = [u'mod', u'test', u'util', u'a', u'py', u'init', u'7']
+
+
+def instance(n, db_path, files, options, deadline, results):
+    """A single editor: it opens files and searches for them until the
+    deadline and then reports what it has done."""
+    try:
+        results.put(edit(n, db_path, files, options, deadline))
+    except Exception as e:
+        results.put('{0}: {1}'.format(type(e).__name__, e))
+
+
+def edit(n, db_path, files, options, deadline):
+    """To open files and search for them until the deadline."""
+    random.seed(n)
+    engine = ozzy.engine.Engine(db_path, **options)
+
+    updates = dict((path, 0) for path in files)
+    update_times = []
+    query_times = []
+
+    while time.time() < deadline:
+
+        path = random.choice(files)
+        t0 = time.time()
+        if engine.update_file(path):
+            updates[path] += 1
+        update_times.append(time.time() - t0)
+
+        t0 = time.time()
+        try:
+            engine.make_scoreboard(random.choice(SEEDS), None,
+                                   os.path.dirname(path), '', True)
+        except Exception:
+            # queries are not retried: a lock held too long is an error
+            query_times.append(None)
+        else:
+            query_times.append(time.time() - t0)
+
+    engine.close()
+    return updates, update_times, query_times, engine.db.stats
+
+
+def make_files(top, count):
+    """To create 'count' files in a small directory tree."""
+    files = []
+    for i in xrange(count):
+        d = os.path.join(top, 'pkg{0}'.format(i % 7), 'sub{0}'.format(i % 3))
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        name = '{0}_{1}.py'.format(random.choice(['mod', 'test', 'util']), i)
+        path = os.path.join(d, name)
+        open(path, 'w').close()
+        files.append(path)
+    return files
+
+
+def summary(times):
+    """To return the mean and the maximum of the given durations in ms."""
+    times = [t for t in times if t is not None]
+    if not times:
+        return 0, 0
+    return 1000 * sum(times) / len(times), 1000 * max(times)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--processes', type='int', default=8)
+    parser.add_option('--seconds', type='float', default=10)
+    parser.add_option('--files', type='int', default=200)
+    parser.add_option('--busy-timeout', type='int', default=200)
+    parser.add_option('--retries', type='int', default=3)
+    parser.add_option('--db', default=None,
+                      help='index to use (a temporary one by default)')
+    opts, _ = parser.parse_args()
+
+    top = tempfile.mkdtemp(prefix='ozzy-stress-')
+    try:
+        db_path = opts.db or os.path.join(top, 'index.db')
+        files = make_files(os.path.join(top, 'files'), opts.files)
+        options = {'busy_timeout': opts.busy_timeout,
+                   'retries': opts.retries}
+
+        # the database is created before the editors start, just like it
+        # happens with the first Vim instance
+        engine = ozzy.engine.Engine(db_path, **options)
+        before = dict((r.path.encode('utf-8'), r.frequency)
+                      for r in engine.db.all())
+        engine.close()
+
+        results = multiprocessing.Queue()
+        deadline = time.time() + opts.seconds
+        procs = [multiprocessing.Process(
+                    target=instance,
+                    args=(n, db_path, files, options, deadline, results))
+                 for n in range(opts.processes)]
+        for p in procs:
+            p.start()
+        reports = [results.get() for p in procs]
+        for p in procs:
+            p.join()
+
+        errors = [r for r in reports if isinstance(r, str)]
+        reports = [r for r in reports if not isinstance(r, str)]
+        for error in errors:
+            print "editor crashed:   {0}".format(error)
+
+        expected = dict((path, before.get(path, 0)) for path in files)
+        update_times = []; query_times = []
+        stats = {'writes': 0, 'retries': 0, 'failures': 0, 'wait': 0.0,
+                 'lock_wait': 0.0}
+        for updates, u_times, q_times, db_stats in reports:
+            for path, count in updates.items():
+                expected[path] += count
+            update_times.extend(u_times)
+            query_times.extend(q_times)
+            for k in stats:
+                stats[k] += db_stats[k]
+
+        engine = ozzy.engine.Engine(db_path, **options)
+        actual = dict((r.path.encode('utf-8'), r.frequency)
+                      for r in engine.db.all())
+        engine.close()
+        lost = sum(max(expected[p] - actual.get(p, 0), 0) for p in files)
+
+        print "processes:        {0}".format(opts.processes)
+        print "duration:         {0:.1f}s".format(opts.seconds)
+        print "updates:          {0} ({1:.0f}/s), mean {2:.1f}ms, " \
+              "max {3:.1f}ms".format(
+                  len(update_times), len(update_times) / opts.seconds,
+                  *summary(update_times))
+        print "queries:          {0} ({1:.0f}/s), mean {2:.1f}ms, " \
+              "max {3:.1f}ms, failed {4}".format(
+                  len(query_times), len(query_times) / opts.seconds,
+                  *summary(query_times) + (query_times.count(None),))
+        print "lock waits:       {0:.2f}s blocked on the lock, " \
+              "{1:.2f}s of backoff".format(stats['lock_wait'], stats['wait'])
+        print "retries:          {0}".format(stats['retries'])
+        print "failed writes:    {0}".format(stats['failures'])
+        print "lost updates:     {0}".format(lost)
+
+        return 1 if lost or errors or query_times.count(None) else 0
+
+    finally:
+        shutil.rmtree(top, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+ozzy.cache
+~~~~~~~~~~
+
+This module defines the class responsible for caching the ranked results
+of the queries across launcher sessions.
+"""
+
+from collections import OrderedDict
+
+
+class ResultsCache:
+    """A bounded LRU cache whose entries are tagged with the generation
+    of the index they have been computed from. Generations are only
+    compared for equality, so they can be any value."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        """To get the results cached for the given key. Results computed
+        from an older generation of the index are discarded."""
+        entry = self.entries.pop(key, None)
+        if entry is None or entry[0] != generation:
+            self.misses += 1
+            return None
+        # the most recently used entry always goes last
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, generation, results):
+        """To cache the results for the given key."""
+        if self.size <= 0:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = (generation, results)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """To remove all the cached results."""
+        self.entries.clear()
+
+    def stats(self):
+        """To return some statistics about the cache usage."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.entries), 'size': self.size}
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+ozzy.channel
+~~~~~~~~~~~~
+
+This module defines the class responsible for the communication with the
+search worker, a separate python process started as a vim job.
+"""
+
+import os
+import vim
+import json
+
+
+class WorkerChannel:
+
+    def __init__(self, db_path, options, python):
+        self.db_path = db_path
+        self.options = options
+        self.python = python
+        self.last_id = 0
+
+    def start(self):
+        """To start the search worker. False is returned if vim does not
+        support jobs or the worker cannot be started."""
+        if vim.eval("has('job') && has('channel')") != '1':
+            return False
+
+        script = os.path.join(os.path.dirname(__file__), 'worker.py')
+        cmd = [self.python, '-u', script, self.db_path,
+               json.dumps(self.options)]
+        vim.command(
+            "let g:_ozzy_worker_job = job_start([{0}], "
+            "{{'mode': 'nl', 'err_io': 'null'}})".format(
+                ', '.join(_quote(arg) for arg in cmd)))
+        return self.alive()
+
+    def alive(self):
+        """To check whether the worker is still running."""
+        return vim.eval("job_status(g:_ozzy_worker_job)") == 'run'
+
+    def stop(self):
+        """To stop the worker."""
+        vim.command("call job_stop(g:_ozzy_worker_job)")
+
+    def send(self, method, **params):
+        """To send a request to the worker without waiting for the reply.
+        The id of the request is returned."""
+        self.last_id += 1
+        msg = json.dumps({'id': self.last_id, 'method': method,
+                          'params': params})
+        vim.command('call ch_sendraw(g:_ozzy_worker_job, {0} . "\\n")'.format(
+            _quote(msg)))
+        return self.last_id
+
+    def receive(self):
+        """To yield the replies received so far, without blocking."""
+        while True:
+            line = vim.eval("ch_read(g:_ozzy_worker_job, {'timeout': 0})")
+            if not line:
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _quote(s):
+    """To turn a string into a vim string literal."""
+    return "'{0}'".format(s.replace("'", "''"))
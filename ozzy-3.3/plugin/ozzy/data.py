@@ -1,23 +1,18 @@
 # -*- coding: utf-8 -*-
 """
-ozzy.db
-~~~~~~~
+ozzy.data
+~~~~~~~~~
 
 This module defines the class responsible for the high-level operations
 on the database such as data retrieval, data updates and data removal.
 """
 
-from __future__ import division
-
-import os
 import vim
 import json
-from math import sqrt
-from datetime import datetime
-from itertools import ifilter
-from collections import OrderedDict
 
-import ozzy.db
+import ozzy.engine
+import ozzy.channel
+import ozzy.providers
 import ozzy.utils.misc
 import ozzy.utils.settings
 
@@ -30,135 +25,178 @@ class Data:
         self.misc = ozzy.utils.misc
 
         self.plug = plug
-        self.db = ozzy.db.DBProxy(db_path)
+
+        options = {
+            'cache_size': self.settings.get('cache_size', int),
+            'frozen_index': self.settings.get('frozen_index', bool),
+            'busy_timeout': self.settings.get('busy_timeout', int),
+            'retries': self.settings.get('write_retries', int),
+            'python': self.settings.get('worker_python'),
+        }
+
+        # queries and updates are handed to a separate process, if possible
+        self.worker = None
+        self.scoreboard_request = None
+        self.scoreboard_args = None
+        if self.settings.get('worker', bool):
+            worker = ozzy.channel.WorkerChannel(
+                db_path, options, self.settings.get('worker_python'))
+            if worker.start():
+                self.worker = worker
+
+        # the in-process engine is used when the worker is not available
+        # (the snapshot of the index is then kept up to date by the worker)
+        if self.worker:
+            options['frozen_index'] = False
+        self.engine = ozzy.engine.Engine(db_path, **options)
+
+        # candidates from other sources than the history, from the fastest
+        # to the slowest
+        self.providers = [ozzy.providers.providers[name]()
+                          for name in self.settings.get('providers')
+                          if name in ozzy.providers.providers]
 
     def close(self):
         """To perform some cleanup actions."""
-        self.db.close()
+        if self.worker:
+            self.worker.stop()
+        self.engine.close()
+
+    def use_worker(self):
+        """To check whether queries are answered by the search worker."""
+        if self.worker and not self.worker.alive():
+            # fall back to the in-process engine
+            self.worker = None
+            self.engine.invalidate()
+        return self.worker is not None
 
     def update_file(self, bufname):
         """To add or update the given file."""
-        now = datetime.now()
-        if bufname in self.db:
-            self.db.update(bufname, +1, now)
+        if self.use_worker():
+            self.worker.send('update_file', path=bufname)
+            self.engine.invalidate()
         else:
-            self.db.add(bufname, now)
+            self.engine.update_file(bufname)
 
     def delete_file(self, path):
         """To remove the given file from the database."""
-        self.db.delete_many([path])
-
-    def clear_index(self):
-        self.db.delete_all()
-
-    def make_scoreboard(self, seed, exclude=None):
-        """To compute the score for each match, the lower the better."""
-        cwd = self.misc.cwd()
-        now = datetime.now()
-        bytime = {}; bydist = {}; byfreq = {}; bypos = {}
-
-        matches = self.db.get(seed, exclude)
-
-        if self.plug.mode:
-            root = self.misc.find_root(cwd, self.settings.get('root_markers'))
-            if root:
-                matches = ifilter(lambda r: r.path.startswith(root), matches)
+        self.delete_files([path])
 
-        if not self.settings.get("ignore_case", bool):
-            matches = (m for m in matches if seed in m.fname)
-
-        for r in matches:
-
-            # delete the file from the database if it does not exist
-            if not os.path.exists(r.path):
-                self.delete_file(r.path)
-                continue
-
-            bytime[r.path] = sqrt(self.misc.to_minutes(now - r.last_access))
-            bydist[r.path] = self.misc.distance(cwd, r.path)**2 + 1
-            byfreq[r.path] = sqrt(r.frequency)
-            bypos[r.path] = os.path.basename(r.path).lower().index(seed.lower()) + 1
-
-        if bytime:
-
-            maxtime = max(bytime.values())
-            maxdist = max(bydist.values())
-            maxfreq = max(byfreq.values())
-            maxpos = max(bypos.values())
-
-            for path in bytime:
-                freq_norm = 1 - byfreq[path] / maxfreq
-                time_norm = (bytime[path] / maxtime)**0.4
-                dist_norm = (bydist[path] / maxdist)**0.4
-                pos_norm = bypos[path] / maxpos
-                yield (freq_norm + time_norm + dist_norm + pos_norm, path)
+    def delete_files(self, paths):
+        """To remove the given files from the database."""
+        if self.use_worker():
+            self.worker.send('delete_files', paths=paths)
+            self.engine.invalidate()
+        else:
+            self.engine.delete_files(paths)
 
+    def clear_index(self):
+        if self.use_worker():
+            self.worker.send('clear_index')
+            self.engine.invalidate()
         else:
+            self.engine.clear_index()
+
+    def make_scoreboard(self, seed, exclude=None, limit=None, interrupt=None):
+        """To return the score for each match, the lower the better.
+        When a 'limit' is given, the ranking might be done by the database
+        and only the best 'limit' matches returned. The computation is
+        abandoned as soon as 'interrupt' returns True, and only the scores
+        computed so far are returned (None if there are none)."""
+        results = None
+        for results in self.make_scoreboards(seed, exclude, limit, interrupt):
+            pass
+        return results
+
+    def make_scoreboards(self, seed, exclude=None, limit=None,
+                         interrupt=None):
+        """To yield more and more complete scoreboards: the first one ranks
+        the history only, then the candidates from each provider are merged
+        in, one provider at a time. Scoreboards stop coming as soon as
+        'interrupt' returns True, possibly before the first one."""
+        cwd, root, ignore_case = self._context()
+        sql_ranking = self.settings.get("sql_ranking", bool)
+
+        results, complete = self.engine.make_scoreboard(
+            seed, exclude, cwd, root, ignore_case, limit, sql_ranking,
+            interrupt)
+        if results is None:
+            # the ranking by the database has been abandoned
             return
-
-    def _make_rich_scoreboard(self, seed, exclude=None):
-        """Make a scoreboard plenty of information. For debug only."""
-        cwd = self.misc.cwd()
-        now = datetime.now()
-        bytime = {}; bydist = {}; byfreq = {}; bypos = {}
-
-        matches = list(self.db.get(seed, exclude))
-
-        root = self.misc.find_root(cwd, self.settings.get('root_markers'))
-        if self.plug.mode and root:
-            matches = ifilter(lambda r: r.path.startswith(root), matches)
-
-        if not self.settings.get("ignore_case", bool):
-            matches = (m for m in matches if seed in m.fname)
-
-        for r in matches:
-
-            # delete the file from the database if it does not exist
-            if not os.path.exists(r.path):
-                self.delete_file(r.path)
+        yield results
+
+        # the history is scanned once, then only the new candidates are
+        # added to its board at each stage
+        board = None
+        for provider in self.providers:
+            if not complete or interrupt and interrupt():
+                return
+            candidates = provider.lookup(seed, exclude, cwd, root, ignore_case)
+            if not candidates:
                 continue
-
-            bytime[r.path] = sqrt(self.misc.to_minutes(now - r.last_access))
-            bydist[r.path] = self.misc.distance(cwd, r.path)**2 + 1
-            byfreq[r.path] = sqrt(r.frequency)
-            bypos[r.path] = os.path.basename(r.path).lower().index(seed.lower()) + 1
-
-        if bytime:
-
-            maxtime = max(bytime.values())
-            maxdist = max(bydist.values())
-            maxfreq = max(byfreq.values())
-            maxpos = max(bypos.values())
-
-            results = dict()
-
-            for r in matches:
-
-                if r.path in bytime:
-
-                    freq_score = 1 - byfreq[r.path] / maxfreq
-                    time_score = (bytime[r.path] / maxtime)**0.4
-                    dist_score = (bydist[r.path] / maxdist)**0.4
-                    pos_score = bypos[r.path] / maxpos
-
-                    d = OrderedDict()
-                    d['score'] = freq_score + time_score + dist_score + pos_score
-                    d['freq'] = sqrt(r.frequency)
-                    d['freq_score'] = freq_score
-                    d['timedelta'] = bytime[r.path]
-                    d['timedelta_score'] = time_score
-                    d['dist'] = bydist[r.path]
-                    d['dist_score'] = dist_score
-                    d['seedpos'] = bypos[r.path]
-                    d['seedpos_score'] = pos_score
-                    results[r.path] = d
-
-            return OrderedDict(
-                sorted([(path, d) for path, d in results.items()],
-                       key=lambda t: t[1]['score']))
+            if board is None:
+                board = self.engine.history_board(
+                    seed, exclude, cwd, root, ignore_case, interrupt)
+                if not board.complete:
+                    return
+            board = self.engine.merge_candidates(board, candidates, cwd, root)
+            yield self.engine.scores(board)
+
+    def request_scoreboard(self, seed, exclude=None, limit=None):
+        """To ask the search worker for the scoreboard. The results are
+        collected with poll_scoreboard."""
+        cwd, root, ignore_case = self._context()
+        self.scoreboard_args = (seed, exclude, limit)
+        self.scoreboard_request = self.worker.send(
+            'make_scoreboard', seed=seed, exclude=exclude, cwd=cwd, root=root,
+            ignore_case=ignore_case, limit=limit,
+            sql_ranking=self.settings.get("sql_ranking", bool))
+
+    def waiting_scoreboard(self):
+        """To check whether the reply to the last request sent to the
+        search worker is still awaited."""
+        return self.scoreboard_request is not None
+
+    def poll_scoreboard(self):
+        """To return the scoreboard for the last request sent to the search
+        worker, if it has arrived. Replies to older requests are dropped.
+        A query cut short by another message is sent again, and the partial
+        scoreboard is returned in the meantime. If the worker fails to
+        answer, the error is reported and the scoreboard is computed in
+        process instead."""
+        results = None
+        for reply in self.worker.receive():
+            if reply.get('id') != self.scoreboard_request:
+                continue
+            self.scoreboard_request = None
+            if 'result' in reply:
+                if reply['result'] is not None:
+                    results = [tuple(r) for r in reply['result']]
+                if not reply.get('complete', True):
+                    self.request_scoreboard(*self.scoreboard_args)
+            elif 'error' in reply:
+                self.misc.echom("search worker error: {0}".format(
+                    reply['error']))
+                results = self.make_scoreboard(*self.scoreboard_args)
+        return results
+
+    def explain(self, seed, exclude=None, limit=None):
+        """To return how the score of the best matches is computed and how
+        long it takes."""
+        cwd, root, ignore_case = self._context()
+        return self.engine.explain(
+            seed, exclude, cwd, root, ignore_case, limit)
+
+    def _context(self):
+        """To return the current directory, the current project root (only
+        in project mode) and whether the search ignores case."""
+        cwd = self.misc.cwd()
+        if self.plug.mode:
+            root = self.misc.find_root(cwd, self.settings.get('root_markers'))
         else:
-            return {}
+            root = ''
+        return cwd, root, self.settings.get("ignore_case", bool)
 
     def print_scoreboard(self, seed='', indent=2):
         """Print the scoreboard. For debug only."""
-        print json.dumps(self.make_rich_scoreboard(seed), indent=indent)
+        print json.dumps(self.explain(seed), indent=indent)
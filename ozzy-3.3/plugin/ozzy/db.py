@@ -9,114 +9,524 @@ communication with the sqlite database.
 
 import os
 import time
+import math
 import sqlite3
-from collections import namedtuple
+
+
+class Row(object):
+    """A single record of the files index."""
+
+    __slots__ = ('path', 'fname', 'frequency', 'last_access', 'pos',
+                 'dirname')
+
+    def __init__(self, path, fname, frequency, last_access, pos=0,
+                 dirname=None):
+        self.path = path
+        self.fname = fname
+        self.frequency = frequency
+        self.last_access = last_access
+        # position of the match in the file name (1-based), if any
+        self.pos = pos
+        # directory of the file, shared by the rows of the same directory
+        self.dirname = dirname or os.path.dirname(path)
+
+    def __repr__(self):
+        return "Row(path={0!r}, fname={1!r}, frequency={2!r}, " \
+               "last_access={3!r}, pos={4!r})".format(
+                   self.path, self.fname, self.frequency, self.last_access,
+                   self.pos)
 
 
 class DBProxy(object):
     """Database proxy."""
 
-    def __init__(self, path_db):
+    def __init__(self, path_db, busy_timeout=200, retries=3):
+
+        self.SCHEMA_VERSION = 3
 
+        # Files are stored by directory, so that directory paths are stored
+        # only once and everything that depends on the directory only is
+        # computed once per directory. Directory ids are never reused, so
+        # that they can be cached (see dirname). 'fname_fold' is the
+        # case-folded file name (see fold), so that case insensitive
+        # searches do not depend on the ASCII-only LIKE.
         self.SCHEMA = """
-            CREATE TABLE files_index (
-                path string primary key,
-                fname string not null,
+            CREATE TABLE IF NOT EXISTS directories (
+                id integer primary key autoincrement,
+                path text unique not null
+            );
+            CREATE TABLE IF NOT EXISTS files_index (
+                dir integer not null,
+                fname text not null,
+                fname_fold text not null,
                 frequency integer not null,
-                last_access timestamp not null
-            );"""
+                last_access integer not null,
+                primary key (dir, fname)
+            );
+            PRAGMA user_version = 3;"""
+
+        # Migrations are indexed by the schema version they lead to. Another
+        # Vim instance might migrate the database at the same time: each
+        # migration must either be safe to run again on an already migrated
+        # database or fail (see migrate).
+        self.MIGRATIONS = {
+            # 'last_access' from a datetime string (local time) to an
+            # integer epoch timestamp
+            1: """
+                BEGIN IMMEDIATE;
+                CREATE TABLE files_index_new (
+                    path string primary key,
+                    fname string not null,
+                    frequency integer not null,
+                    last_access integer not null
+                );
+                INSERT INTO files_index_new
+                    SELECT path, fname, frequency,
+                        CASE WHEN typeof(last_access) = 'integer'
+                        THEN last_access
+                        ELSE coalesce(
+                            CAST(strftime('%s', last_access, 'utc') AS integer),
+                            CAST(strftime('%s', 'now') AS integer))
+                        END
+                    FROM files_index;
+                DROP TABLE files_index;
+                ALTER TABLE files_index_new RENAME TO files_index;
+                PRAGMA user_version = 1;
+                COMMIT;""",
+            # case-folded file names (taken from the paths since numeric
+            # names are stored as numbers by the former 'string' columns)
+            2: """
+                BEGIN IMMEDIATE;
+                CREATE TABLE files_index_new (
+                    path string primary key,
+                    fname string not null,
+                    fname_fold string not null,
+                    frequency integer not null,
+                    last_access integer not null
+                );
+                INSERT INTO files_index_new
+                    SELECT path, ozzy_basename(path),
+                        ozzy_fold(ozzy_basename(path)), frequency,
+                        last_access
+                    FROM files_index;
+                DROP TABLE files_index;
+                ALTER TABLE files_index_new RENAME TO files_index;
+                PRAGMA user_version = 2;
+                COMMIT;""",
+            # directories moved to their own table (file names are taken
+            # from the paths since numeric names might have been mangled
+            # by the former 'string' columns)
+            3: """
+                BEGIN IMMEDIATE;
+                CREATE TABLE directories (
+                    id integer primary key autoincrement,
+                    path text unique not null
+                );
+                INSERT INTO directories (path)
+                    SELECT DISTINCT ozzy_dirname(path) FROM files_index;
+                CREATE TABLE files_index_new (
+                    dir integer not null,
+                    fname text not null,
+                    fname_fold text not null,
+                    frequency integer not null,
+                    last_access integer not null,
+                    primary key (dir, fname)
+                );
+                INSERT INTO files_index_new
+                    SELECT directories.id, ozzy_basename(files_index.path),
+                        ozzy_fold(ozzy_basename(files_index.path)),
+                        frequency, last_access
+                    FROM files_index JOIN directories
+                        ON directories.path = ozzy_dirname(files_index.path);
+                DROP TABLE files_index;
+                ALTER TABLE files_index_new RENAME TO files_index;
+                PRAGMA user_version = 3;
+                COMMIT;"""
+        }
 
+        # Writes that fail because another process holds the lock for more
+        # than 'busy_timeout' milliseconds are retried up to 'retries' times,
+        # waiting BACKOFF seconds before the first retry and twice as long
+        # before each of the next ones. The time spent blocked on the lock
+        # and the time spent in backoff are both recorded.
+        self.retries = retries
+        self.BACKOFF = 0.05
+        self.stats = {'writes': 0, 'retries': 0, 'failures': 0, 'wait': 0.0,
+                      'lock_wait': 0.0}
+
+        self.path_db = path_db
         missing_db = not os.path.exists(path_db)
-        self.conn = sqlite3.connect(path_db,
-            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
-        self.Row = namedtuple('Row', "path fname frequency last_access")
+        self.conn = sqlite3.connect(path_db, timeout=busy_timeout / 1000.0,
+                                    check_same_thread=False)
+        self.Row = Row
+
+        # directory paths by id, and the other way around
+        self.directories = {}
+        self.directory_ids = {}
+        self.directories_fold = {}
+        self.last_directory = 0
+
+        # number of rows fetched at once when scanning the index
+        self.ARRAYSIZE = 256
+
+        # scalar functions used to rank the matches in the database (the
+        # 'ozzy_distance' function is registered by the engine), while
+        # window functions are required to normalize the scores
+        self.conn.create_function('ozzy_sqrt', 1, math.sqrt)
+        self.conn.create_function('ozzy_pow', 2, math.pow)
+        self.conn.create_function('ozzy_fold', 1, fold)
+        self.conn.create_function('ozzy_dirname', 1, os.path.dirname)
+        self.conn.create_function('ozzy_basename', 1, os.path.basename)
+        self.can_rank = sqlite3.sqlite_version_info >= (3, 25, 0)
+        self.has_data_version = sqlite3.sqlite_version_info >= (3, 8, 8)
+        if sqlite3.sqlite_version_info < (3, 7, 15):
+            self.conn.create_function('instr', 2, _instr)
+
+        # number of virtual machine instructions between two checks for an
+        # interruption of a long running query
+        self.PROGRESS_STEPS = 10000
 
         if missing_db:
             self.conn.executescript(self.SCHEMA)
             self.conn.commit()
+        else:
+            self.migrate()
+
+    def migrate(self):
+        """To bring an existing database up to the current schema."""
+        for attempt in range(self.retries + 1):
+            try:
+                version = self.conn.execute(
+                    "PRAGMA user_version").fetchone()[0]
+                for v in range(version + 1, self.SCHEMA_VERSION + 1):
+                    self.conn.executescript(self.MIGRATIONS[v])
+                return
+            except sqlite3.OperationalError as e:
+                self.conn.rollback()
+                if self._version() >= self.SCHEMA_VERSION:
+                    # another Vim instance has migrated the database
+                    return
+                if not _is_locked(e) or attempt == self.retries:
+                    raise
+                self.backoff(attempt)
+
+    def _version(self):
+        """To return the schema version of the database, or -1 if it is
+        unknown because the database is locked."""
+        try:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0]
+        except sqlite3.OperationalError:
+            return -1
+
+    def backoff(self, attempt):
+        """To wait before retrying an operation that failed because the
+        database was locked."""
+        delay = self.BACKOFF * 2 ** attempt
+        self.stats['retries'] += 1
+        self.stats['wait'] += delay
+        time.sleep(delay)
 
     def commit(func):
+        """To commit the changes made by the decorated method. The whole
+        transaction is retried while the database is locked by another
+        process. True is returned if the changes have been committed."""
         def f(self, *args, **kwargs):
-            func(self, *args, **kwargs)
-            self.conn.commit()
+            for attempt in range(self.retries + 1):
+                try:
+                    # the write lock is taken first, so that the time SQLite
+                    # spends waiting for it can be measured
+                    t0 = time.time()
+                    try:
+                        self.conn.execute("BEGIN IMMEDIATE")
+                    finally:
+                        self.stats['lock_wait'] += time.time() - t0
+                    func(self, *args, **kwargs)
+                    self.conn.commit()
+                    self.stats['writes'] += 1
+                    return True
+                except sqlite3.OperationalError as e:
+                    self.conn.rollback()
+                    if not _is_locked(e):
+                        raise
+                    if attempt < self.retries:
+                        self.backoff(attempt)
+            self.stats['failures'] += 1
+            return False
         return f
 
-    def __contains__(self, path):
-        """Implements the 'in' operator behavior."""
-        query = "SELECT * FROM files_index WHERE path=?"
-        r = self.conn.execute(query, (u"{0}".format(path.decode('utf-8')),)).fetchone()
-        return True if r else False
+    def data_version(self):
+        """To return a value that changes whenever another connection, in
+        this process or another one, commits changes to the database."""
+        if self.has_data_version:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+        try:
+            return os.stat(self.path_db).st_mtime
+        except OSError:
+            return None
+
+    # condition matching a single file by its path (see _split)
+    WHERE_PATH = "dir=(SELECT id FROM directories WHERE path=?) AND fname=?"
+
+    def dirname(self, dir_id):
+        """To return the path of a directory given its id. Paths are loaded
+        once and shared by all the rows of the same directory."""
+        path = self.directories.get(dir_id)
+        if path is None:
+            self.load_directories()
+            path = self.directories[dir_id]
+        return path
+
+    def load_directories(self):
+        """To load the directories added since the last call. Ids always
+        grow, so those are the ones with a greater id."""
+        query = "SELECT id, path FROM directories WHERE id>? ORDER BY id"
+        for dir_id, path in self.conn.execute(query, (self.last_directory,)):
+            self.directories[dir_id] = path
+            self.directory_ids[path] = dir_id
+            self.directories_fold[dir_id] = fold(path)
+            self.last_directory = dir_id
+
+    def _directories_matching(self, token, case_sensitive):
+        """To return the ids of the directories whose path contains the
+        given token."""
+        if case_sensitive:
+            directories = self.directories
+        else:
+            directories = self.directories_fold
+        return [dir_id for dir_id, path in directories.iteritems()
+                if token in path]
+
+    def _rows(self, query, params):
+        """To stream the rows returned by the given query without loading
+        them all in memory at once. The query must select the directory
+        id, the file name, the frequency, the last access time and the
+        position of the match."""
+        cursor = self.conn.cursor()
+        cursor.arraysize = self.ARRAYSIZE
+        try:
+            cursor.execute(query, params)
+            Row = self.Row
+            join = os.path.join
+            directories = self.directories
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                for dir_id, fname, frequency, last_access, pos in rows:
+                    dirname = directories.get(dir_id)
+                    if dirname is None:
+                        dirname = self.dirname(dir_id)
+                    yield Row(join(dirname, fname), fname, frequency,
+                              last_access, pos, dirname)
+        finally:
+            cursor.close()
+
+    def _exclude(self, exclude, where, params):
+        """To add the condition that leaves out the 'exclude' file."""
+        if not exclude:
+            return
+        dirname, fname = _split(u"{0}".format(exclude.decode('utf-8')))
+        self.load_directories()
+        dir_id = self.directory_ids.get(dirname)
+        if dir_id is not None:
+            where.append("NOT (dir=? AND fname=?)")
+            params.extend((dir_id, fname))
 
     def all(self, exclude=None):
         """To get all rows."""
-        if exclude:
-            exclude = u"{0}".format(exclude.decode('utf-8'))
-        query = "SELECT * FROM files_index"
-        if exclude:
-            query += " WHERE path!=?"
-            r = self.conn.execute(query, (exclude,)).fetchall()
-        else:
-            r = self.conn.execute(query).fetchall()
-
-        for row in r:
-            yield self.Row(*row)
-
-    def get(self, target, exclude=None):
-        """To get all rows whose 'fname' field contains 'target' ."""
-        target = u"%{0}%".format(target.replace('%', '\%'))
-        if exclude:
-            exclude = u"{0}".format(exclude.decode('utf-8'))
-        query = "SELECT * FROM files_index WHERE fname LIKE ?"
-        if exclude:
-            query += " AND path!=?"
-            r = self.conn.execute(query, (target, exclude)).fetchall()
+        where, params = ["1"], []
+        self._exclude(exclude, where, params)
+        query = ("SELECT dir, fname, frequency, last_access, 0 "
+                 "FROM files_index WHERE " + " AND ".join(where))
+        return self._rows(query, params)
+
+    def get(self, target, exclude=None, case_sensitive=False):
+        """To get all rows whose 'fname' field contains 'target', along
+        with the position of the match."""
+        column, target, where, params = self._match(target, case_sensitive)
+        where.insert(0, "pos > 0")
+        params.insert(0, target)
+        self._exclude(exclude, where, params)
+        query = ("SELECT dir, fname, frequency, last_access, pos FROM ("
+                 "SELECT *, instr({0}, ?) AS pos FROM files_index"
+                 ") WHERE {1}").format(column, " AND ".join(where))
+        return self._rows(query, params)
+
+    def _match(self, query, case_sensitive):
+        """To return the column to search, the token the file name must
+        contain and the conditions, with their parameters, for the other
+        tokens of the query (see split_query). The directories matching
+        each token are looked up in memory and the tokens matching the
+        fewest directories are checked first."""
+        others, target = split_query(query)
+        if case_sensitive:
+            column = 'fname'
         else:
-            r = self.conn.execute(query, (target,)).fetchall()
+            column = 'fname_fold'
+            target = fold(target)
+            others = [fold(token) for token in others]
 
-        for row in r:
-            yield self.Row(*row)
+        if others:
+            self.load_directories()
+        tokens = [(self._directories_matching(token, case_sensitive), token)
+                  for token in others]
+        tokens.sort(key=lambda t: len(t[0]))
 
-    @commit
-    def add(self, path, last_access):
-        """To add a new record."""
-        path = u"{0}".format(path.decode('utf-8'))
+        where = []
+        params = []
+        for dir_ids, token in tokens:
+            where.append("(instr({0}, ?) > 0 OR dir IN ({1}))".format(
+                column, ",".join(str(i) for i in dir_ids)))
+            params.append(token)
+        return column, target, where, params
+
+    def rank(self, target, cwd, now, limit, exclude=None, root=None,
+             case_sensitive=False, interrupt=None):
+        """To get the 'limit' rows with the best score whose 'fname' field
+        contains 'target'. Scores are computed by the database, the lower
+        the better, and returned along with the paths. None is returned if
+        'interrupt' returns True before the query is completed."""
+        cwd = u"{0}".format(cwd.decode('utf-8'))
+        column, target, where, params = self._match(target, case_sensitive)
+        where.insert(0, "instr({0}, ?) > 0".format(column))
+        params[:0] = [now, cwd, target, target]
+        self._exclude(exclude, where, params)
+        if root:
+            root = u"{0}".format(root.decode('utf-8'))
+            where.append("substr(directories.path, 1, ?)=?")
+            params.extend((len(root), root))
+        params.append(limit)
+
+        # the distance is computed by directory (see Engine.distance)
+        query = """
+            SELECT
+                1 - f / max(f) OVER ()
+                + CASE WHEN max(t) OVER () > 0
+                  THEN ozzy_pow(t / max(t) OVER (), 0.4) ELSE 0 END
+                + ozzy_pow(d / max(d) OVER (), 0.4)
+                + p / max(p) OVER () AS score,
+                dir, fname
+            FROM (
+                SELECT
+                    dir, fname,
+                    ozzy_sqrt(frequency) AS f,
+                    ozzy_sqrt(max(? - last_access, 0) / 60.0) AS t,
+                    ozzy_pow(ozzy_distance(?, directories.path), 2) + 1 AS d,
+                    instr({0}, ?) * 1.0 AS p
+                FROM files_index JOIN directories ON dir=directories.id
+                WHERE {1}
+            )
+            ORDER BY score
+            LIMIT ?""".format(column, " AND ".join(where))
+
+        if interrupt:
+            self.conn.set_progress_handler(interrupt, self.PROGRESS_STEPS)
         try:
-            sql = "INSERT INTO files_index VALUES (?, ?, ?, ?)"
-            self.conn.execute(sql,
-                (path, os.path.basename(path), 1, last_access))
-        except Exception as e:
-            pass
+            rows = self.conn.execute(query, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # only the abort by the progress handler is expected
+            if not interrupt or str(e) != 'interrupted':
+                raise
+            return None
+        finally:
+            if interrupt:
+                self.conn.set_progress_handler(None, 0)
+
+        return [(score, os.path.join(self.dirname(dir_id), fname))
+                for score, dir_id, fname in rows]
+
+    def create_function(self, name, num_params, func):
+        """To make a python function available to the queries."""
+        self.conn.create_function(name, num_params, func)
 
     @commit
-    def update(self, path, frequency=None, last_access=None):
-        """To update attributes of an existing record."""
+    def touch(self, path, last_access):
+        """To add a new record or, if it already exists, to increase its
+        frequency. Both happen in the same transaction so that concurrent
+        updates are never lost."""
         path = u"{0}".format(path.decode('utf-8'))
-        if frequency and not last_access:
-            sql = ("UPDATE files_index SET "
-                   "frequency=frequency+? WHERE path=?")
-            self.conn.execute(sql, (frequency, path))
-
-        elif last_access and not frequency:
-            sql = "UPDATE files_index SET last_access=? WHERE path=?"
-            self.conn.execute(sql, (last_access, path))
+        sql = ("UPDATE files_index SET frequency=frequency+1, "
+               "last_access=? WHERE " + self.WHERE_PATH)
+        if not self.conn.execute(sql, (last_access,) + _split(path)).rowcount:
+            self._insert(path, last_access)
 
-        elif frequency and last_access:
-            sql = ("UPDATE files_index SET "
-                   "frequency=frequency+?, last_access=? WHERE path=?")
-            self.conn.execute(sql, (frequency, last_access, path))
+    def _insert(self, path, last_access):
+        """To insert a new record, along with its directory if needed, and
+        keep the case-folded file name in sync with the file name."""
+        dirname, fname = _split(path)
+        # the directory is inserted first so that the write lock is held
+        # before looking up its id
+        self.conn.execute(
+            "INSERT OR IGNORE INTO directories (path) VALUES (?)", (dirname,))
+        dir_id = self.conn.execute(
+            "SELECT id FROM directories WHERE path=?", (dirname,)).fetchone()[0]
+        sql = ("INSERT INTO files_index "
+               "(dir, fname, fname_fold, frequency, last_access) "
+               "VALUES (?, ?, ?, ?, ?)")
+        self.conn.execute(sql, (dir_id, fname, fold(fname), 1, last_access))
 
     @commit
     def delete_many(self, paths):
-        """To delete a bunch of records given their paths."""
-        sql = "DELETE FROM files_index WHERE path=?"
-        self.conn.executemany(sql, [(u"{0}".format(path),)
+        """To delete a bunch of records given their paths, along with the
+        directories left empty."""
+        sql = "DELETE FROM files_index WHERE " + self.WHERE_PATH
+        self.conn.executemany(sql, [_split(u"{0}".format(path))
                                     for path in paths])
+        self.conn.execute("DELETE FROM directories "
+                          "WHERE id NOT IN (SELECT dir FROM files_index)")
 
     @commit
     def delete_all(self):
         """To delete all records from the database."""
         self.conn.execute("DELETE FROM files_index")
+        self.conn.execute("DELETE FROM directories")
 
     def close(self):
         """To close the database connection."""
         self.conn.close()
+
+
+def _split(path):
+    """To split a path into the directory and the file name, as they are
+    stored in the database."""
+    return os.path.dirname(path), os.path.basename(path)
+
+
+def split_query(query):
+    """To split a query into tokens separated by spaces. The file name must
+    contain the last token (the match position is the position of this
+    one) while each of the other tokens must be contained either in the
+    file name or in the directory. The other tokens are returned first."""
+    tokens = query.split()
+    if not tokens:
+        return [], query
+    return tokens[:-1], tokens[-1]
+
+
+def match_tokens(tokens, fname, dirname):
+    """To check whether each token is contained either in the file name
+    or in the directory."""
+    for token in tokens:
+        if token not in fname and token not in dirname:
+            return False
+    return True
+
+
+def fold(s):
+    """To return the case-folded version of the given string. Python 2 has
+    no str.casefold, so this is the full Unicode lowercase mapping."""
+    return s.lower()
+
+
+def _instr(s, sub):
+    """To return the position of 'sub' in 's' (1-based), just like the
+    instr function of sqlite 3.7.15 and later."""
+    if s is None or sub is None:
+        return None
+    return s.find(sub) + 1
+
+
+def _is_locked(error):
+    """To check whether an error is due to the database being locked."""
+    msg = str(error)
+    return 'locked' in msg or 'busy' in msg
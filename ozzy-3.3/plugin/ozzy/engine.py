@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+ozzy.engine
+~~~~~~~~~~~
+
+This module defines the class responsible for answering the queries and
+keeping the index up to date. It does not depend on vim, so that it can
+run either inside vim or in the search worker.
+"""
+
+from __future__ import division
+
+import os
+import time
+import heapq
+import subprocess
+from math import sqrt
+from array import array
+from itertools import ifilter, islice
+from collections import OrderedDict
+
+import ozzy.db
+import ozzy.cache
+import ozzy.frozen
+from ozzy.utils.paths import distance
+
+
+class Engine:
+
+    def __init__(self, db_path, cache_size=64, frozen_index=False,
+                 busy_timeout=200, retries=3, python='python'):
+        self.db_path = db_path
+        self.db = ozzy.db.DBProxy(db_path, busy_timeout, retries)
+        self.db.create_function('ozzy_distance', 2, self.distance)
+
+        # distances from the current directory, by directory
+        self.distances = {}
+        self.distances_from = None
+
+        # number of matches examined between two checks for an interruption
+        self.CHUNK_SIZE = 256
+
+        # ranked results are cached across launcher sessions and they are
+        # invalidated as soon as the index changes
+        self.generation = 0
+        self.results_cache = ozzy.cache.ResultsCache(cache_size)
+
+        # score components of the last complete history scan, reused when
+        # candidates from the providers are merged in: (key, generation,
+        # board)
+        self.last_board = None
+
+        # matches are looked up in a read-only snapshot of the index, if
+        # enabled and up to date. The snapshot is rebuilt by a separate
+        # process, run with the given python interpreter, once writes have
+        # settled for FREEZE_DELAY seconds.
+        self.FREEZE_DELAY = 5
+        self.python = python
+        self.frozen = None
+        self.freeze_job = None
+        # database mtime the last rebuild has been started for
+        self.frozen_for = None
+        if frozen_index:
+            self.frozen = ozzy.frozen.FrozenIndex(db_path + '.frozen')
+
+    def close(self):
+        """To perform some cleanup actions."""
+        if self.frozen:
+            self.reap_freeze()
+            self.frozen.close()
+        self.db.close()
+
+    def invalidate(self):
+        """To discard all the cached results."""
+        self.generation += 1
+
+    def frozen_fresh(self):
+        """To check whether the snapshot of the index is up to date, and
+        to have it rebuilt otherwise."""
+        self.reap_freeze()
+        if self.frozen.fresh(self.db_path):
+            return True
+        self.freeze()
+        return False
+
+    def reap_freeze(self):
+        """To collect the exit status of the last rebuild of the snapshot
+        once it is over, so that no zombie process is left behind."""
+        if self.freeze_job and self.freeze_job.poll() is not None:
+            self.freeze_job = None
+
+    def freeze(self):
+        """To start rebuilding the snapshot of the index in a separate
+        process, once writes (from any process) have settled. A single
+        rebuild is started for each state of the database. Failures are
+        not fatal: the database is used until the next successful
+        rebuild."""
+        try:
+            mtime = os.stat(self.db_path).st_mtime
+        except OSError:
+            return
+        if (self.freeze_job or mtime == self.frozen_for
+                or time.time() - mtime < self.FREEZE_DELAY):
+            return
+
+        self.frozen_for = mtime
+        script = os.path.join(os.path.dirname(ozzy.frozen.__file__),
+                              'frozen.py')
+        try:
+            with open(os.devnull, 'r+') as devnull:
+                self.freeze_job = subprocess.Popen(
+                    [self.python, script, self.db_path, self.frozen.path],
+                    stdin=devnull, stdout=devnull, stderr=devnull,
+                    close_fds=True)
+        except OSError:
+            self.freeze_job = None
+
+    def distance(self, cwd, dirname):
+        """To return the distance between the current directory and the
+        directory of a file, plus one for the file itself. Distances are
+        computed once per directory until the current directory changes."""
+        if cwd != self.distances_from:
+            self.distances = {}
+            self.distances_from = cwd
+        dist = self.distances.get(dirname)
+        if dist is None:
+            dist = self.distances[dirname] = distance(cwd, dirname) + 1
+        return dist
+
+    def update_file(self, path):
+        """To add or update the given file. False is returned if the
+        database could not be written."""
+        done = self.db.touch(path, int(time.time()))
+        self.invalidate()
+        return done
+
+    def delete_files(self, paths):
+        """To remove the given files from the database. False is returned
+        if the database could not be written."""
+        done = self.db.delete_many(paths)
+        self.invalidate()
+        return done
+
+    def clear_index(self):
+        """To remove all the files from the database."""
+        self.db.delete_all()
+        self.invalidate()
+
+    def make_scoreboard(self, seed, exclude, cwd, root, ignore_case,
+                        limit=None, sql_ranking=False, interrupt=None):
+        """To return the score for each match, the lower the better.
+        Scores are computed only if not already cached. When a 'limit' is
+        given along with 'sql_ranking', the ranking is done by the database
+        (if supported) and only the best 'limit' matches are returned. The
+        computation is abandoned as soon as 'interrupt' returns True and
+        only the scores computed so far are returned, or None if the
+        ranking was left to the database, which gives no partial results.
+        The second returned value tells whether the scoreboard is
+        complete."""
+        # number of matches actually displayed
+        shown = limit
+        in_db = limit and sql_ranking and self.db.can_rank
+        if not in_db:
+            limit = None
+
+        # the cache is also invalidated by the changes made to the index by
+        # other processes
+        data_version = self.db.data_version()
+        key = (seed, cwd, root, ignore_case, exclude, limit)
+        results = self.results_cache.get(
+            key, (self.generation, data_version))
+        if results is not None:
+            best = heapq.nsmallest(shown, results) if shown else results
+            missing = set(path for score, path in best
+                          if not os.path.exists(path))
+            if not missing:
+                return results, True
+            # files deleted since the results have been cached: other
+            # matches may take their place, so the ranking is done again
+            self.delete_files(missing)
+            data_version = self.db.data_version()
+
+        if in_db:
+            results, complete = self._rank_in_db(
+                seed, exclude, cwd, root, ignore_case, limit, interrupt)
+        else:
+            results, complete = self._make_scoreboard(
+                seed, exclude, cwd, root, ignore_case, interrupt)
+        # missing files might have been removed in the meantime, so the
+        # current generation is the one the results reflect (but not the
+        # current data version, if another process has changed the index
+        # in the meantime)
+        if complete:
+            self.results_cache.set(
+                key, (self.generation, data_version), results)
+
+        return results, complete
+
+    def _rank_in_db(self, seed, exclude, cwd, root, ignore_case, limit,
+                    interrupt=None):
+        """To let the database compute the scores and fetch only the best
+        'limit' matches. The second returned value tells whether the query
+        has been completed or interrupted."""
+        while True:
+            results = self.db.rank(seed, cwd, int(time.time()), limit,
+                                   exclude, root, not ignore_case, interrupt)
+            if results is None:
+                return None, False
+            missing = set(path for score, path in results
+                          if not os.path.exists(path))
+            if not missing:
+                return results, True
+            # delete the files from the database if they do not exist and
+            # rank again so that they do not take any slot. If they cannot
+            # be deleted (the database is locked by another process) they
+            # are just left out, and the results are not cached.
+            if (not self.delete_files(missing)
+                    or interrupt and interrupt()):
+                return [r for r in results if r[1] not in missing], False
+
+    def _make_scoreboard(self, seed, exclude, cwd, root, ignore_case,
+                         interrupt=None):
+        """To compute the score for each match, the lower the better.
+        The second returned value tells whether all the matches have been
+        examined."""
+        board = self.history_board(
+            seed, exclude, cwd, root, ignore_case, interrupt)
+        return self.scores(board), board.complete
+
+    def history_board(self, seed, exclude, cwd, root, ignore_case,
+                      interrupt=None):
+        """To return the raw score components of the indexed files that
+        match the seed. The last complete board is kept until the index
+        changes, so that the candidates from the providers can be merged
+        in without scanning the history again."""
+        key = (seed, exclude, cwd, root, ignore_case)
+        generation = (self.generation, self.db.data_version())
+        if self.last_board and self.last_board[:2] == (key, generation):
+            return self.last_board[2]
+
+        board = self._score_components(
+            seed, exclude, cwd, root, ignore_case, interrupt)
+        if board.complete:
+            # missing files might have been removed in the meantime
+            self.last_board = (key, (self.generation, generation[1]), board)
+        return board
+
+    def merge_candidates(self, board, extra, cwd, root):
+        """To return a copy of the given board with the extra candidates
+        (rows already matching the seed) that are not already in it. Only
+        the new candidates are examined."""
+        now = int(time.time())
+        cwd = cwd.decode('utf-8')
+        if root:
+            root = root.decode('utf-8')
+
+        board = board.copy()
+        seen = set(board.paths)
+        for r in extra:
+            if (r.path in seen or root and not r.path.startswith(root)
+                    or not os.path.exists(r.path)):
+                continue
+            seen.add(r.path)
+            board.add(r, now, self.distance(cwd, r.dirname))
+        return board
+
+    def scores(self, board):
+        """To return the score of each match on the board, the lower the
+        better."""
+        return [(sum(norms), board.paths[i])
+                for i, norms in self._normalize(board)]
+
+    def _score_components(self, seed, exclude, cwd, root, ignore_case,
+                          interrupt=None, timings=None):
+        """To compute the raw score components of each match. Matches are
+        examined in chunks and the computation stops early as soon as
+        'interrupt' returns True. If a 'timings' dictionary is given, the
+        time spent fetching, stat-ing and scoring is added to it."""
+        now = int(time.time())
+        clock = time.time
+
+        # paths from the index are unicode strings
+        cwd = cwd.decode('utf-8')
+        if root:
+            root = root.decode('utf-8')
+        fetch_time = stat_time = score_time = 0
+
+        # score components are kept in parallel arrays
+        board = _Components()
+        missing = []
+
+        # matches come along with the position of the seed in their name
+        matches = None
+        if self.frozen and self.frozen_fresh():
+            matches = self.frozen.get(seed, exclude, not ignore_case)
+        if matches is None:
+            matches = self.db.get(seed, exclude, not ignore_case)
+
+        if root:
+            matches = ifilter(lambda r: r.path.startswith(root), matches)
+
+        while True:
+
+            t0 = clock()
+            chunk = list(islice(matches, self.CHUNK_SIZE))
+            t1 = clock()
+            fetch_time += t1 - t0
+            if not chunk:
+                break
+
+            # files that do not exist anymore are deleted from the
+            # database once the scan is over
+            existing = []
+            for r in chunk:
+                if os.path.exists(r.path):
+                    existing.append(r)
+                elif r.frequency:
+                    missing.append(r.path)
+            t2 = clock()
+            stat_time += t2 - t1
+
+            for r in existing:
+                board.add(r, now, self.distance(cwd, r.dirname))
+
+            score_time += clock() - t2
+
+            if interrupt and interrupt():
+                board.complete = False
+                break
+
+        # release the cursor before touching the database again
+        matches = None
+        if missing:
+            self.delete_files(missing)
+
+        if timings is not None:
+            timings['fetch'] = timings.get('fetch', 0) + fetch_time
+            timings['stat'] = timings.get('stat', 0) + stat_time
+            timings['score'] = timings.get('score', 0) + score_time
+
+        return board
+
+    def _normalize(self, board):
+        """To yield the normalized score components (freq, time, dist, pos)
+        of each match, along with its index."""
+        if not board.paths:
+            return
+
+        maxtime = max(board.bytime)
+        maxdist = max(board.bydist)
+        maxfreq = max(board.byfreq)
+        maxpos = max(board.bypos)
+
+        for i in xrange(len(board.paths)):
+            freq_norm = 1 - board.byfreq[i] / maxfreq if maxfreq else 1
+            if board.bytime[i] < 0:
+                time_norm = 1
+            else:
+                time_norm = (board.bytime[i] / maxtime)**0.4 if maxtime else 0
+            dist_norm = (board.bydist[i] / maxdist)**0.4
+            pos_norm = board.bypos[i] / maxpos
+            yield i, (freq_norm, time_norm, dist_norm, pos_norm)
+
+    def explain(self, seed, exclude, cwd, root, ignore_case, limit=None):
+        """To return how the score of the best matches is computed and how
+        long it takes. The cache is bypassed."""
+        timings = OrderedDict()
+
+        board = self._score_components(
+            seed, exclude, cwd, root, ignore_case, timings=timings)
+
+        t0 = time.time()
+        results = []
+        for i, norms in self._normalize(board):
+            d = OrderedDict()
+            d['path'] = board.paths[i]
+            d['score'] = sum(norms)
+            d['freq'] = board.byfreq[i]
+            d['freq_norm'] = norms[0]
+            d['time'] = board.bytime[i]
+            d['time_norm'] = norms[1]
+            d['dist'] = board.bydist[i]
+            d['dist_norm'] = norms[2]
+            d['pos'] = board.bypos[i]
+            d['pos_norm'] = norms[3]
+            results.append(d)
+        results.sort(key=lambda d: d['score'])
+        timings['score'] += time.time() - t0
+
+        report = OrderedDict()
+        report['query'] = seed
+        report['cwd'] = cwd
+        report['root'] = root
+        report['matches'] = len(results)
+        report['timings'] = timings
+        report['cache'] = self.results_cache.stats()
+        report['db'] = dict(self.db.stats)
+        report['results'] = results[:limit] if limit else results
+        return report
+
+
+class _Components:
+    """Raw score components of the matches, stored in parallel arrays."""
+
+    def __init__(self):
+        self.paths = []
+        self.bytime = array('d')
+        self.bydist = array('d')
+        self.byfreq = array('d')
+        self.bypos = array('d')
+        self.complete = True
+
+    def add(self, r, now, dist):
+        """To add the score components of a match."""
+        self.paths.append(r.path)
+        # candidates that have never been opened are considered the least
+        # recent ones
+        if r.last_access:
+            self.bytime.append(sqrt(max(now - r.last_access, 0) / 60))
+        else:
+            self.bytime.append(-1)
+        self.bydist.append(dist**2 + 1)
+        self.byfreq.append(sqrt(r.frequency))
+        self.bypos.append(r.pos)
+
+    def copy(self):
+        """To return a copy of the board."""
+        board = _Components()
+        board.paths = self.paths[:]
+        board.bytime = self.bytime[:]
+        board.bydist = self.bydist[:]
+        board.byfreq = self.byfreq[:]
+        board.bypos = self.bypos[:]
+        board.complete = self.complete
+        return board
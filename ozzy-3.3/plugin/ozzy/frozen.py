@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+ozzy.frozen
+~~~~~~~~~~~
+
+This module defines the read-only snapshot of the files index used to look
+up matches on very large histories. The snapshot is a single file opened
+with mmap, so that lookups do not copy it in memory and every Vim instance
+shares it through the page cache. The database stays the source of truth:
+the snapshot is used only while the database has not been modified since
+the snapshot was built, and only for the queries it answers faster than
+the database: the ones whose file name token has a trigram shared by few
+records.
+
+The snapshot is built by a separate process so that Vim never pays for it:
+
+    python frozen.py <database path> <snapshot path>
+
+File layout (little-endian):
+
+    header      magic, database mtime, number of records and trigrams,
+                offsets of the sections below
+    paths       (offset, length) of the utf-8 path of each record
+    names       (offset, length) of the case-folded utf-8 file name of
+                each record
+    frequency   frequency of each record
+    access      last access time of each record
+    strings     paths and case-folded file names
+    trigrams    sorted (trigram, postings offset, postings count) entries
+    postings    record numbers, ascending
+"""
+
+import os
+import sys
+import mmap
+import shutil
+import struct
+import sqlite3
+import tempfile
+from array import array
+
+if __name__ == '__main__':
+    # make the ozzy package importable
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import ozzy.db
+
+
+MAGIC = 'OZZYFRZ1'
+HEADER = struct.Struct('<8sdIIQQQQQQQ')
+SPAN = struct.Struct('<II')
+FREQUENCY = struct.Struct('<I')
+ACCESS = struct.Struct('<q')
+TRIGRAM = struct.Struct('<III')
+POSTING = struct.Struct('<I')
+
+# the snapshot is used only if the candidates sharing the rarest trigram of
+# the query are fewer than one record out of SELECTIVITY: beyond that,
+# checking them one at a time is slower than a scan by the database
+SELECTIVITY = 100
+
+
+def build(db_path, path):
+    """To build the snapshot of the given database. Records are streamed
+    from the database and each section is spooled to its own temporary
+    file, so that only the posting lists are held in memory. The snapshot
+    file is replaced atomically."""
+    db_mtime = os.stat(db_path).st_mtime
+    paths, names, freqs, accesses, strings = sections = [
+        tempfile.TemporaryFile() for _ in xrange(5)]
+
+    # trigram -> record numbers
+    grams = {}
+    n = offset = 0
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT directories.path, fname, fname_fold, frequency, "
+            "last_access FROM files_index "
+            "JOIN directories ON dir=directories.id")
+        for d, fname, folded, frequency, last_access in rows:
+            p = os.path.join(d, fname).encode('utf-8')
+            name = folded.encode('utf-8')
+            paths.write(SPAN.pack(offset, len(p)))
+            names.write(SPAN.pack(offset + len(p), len(name)))
+            freqs.write(FREQUENCY.pack(frequency))
+            accesses.write(ACCESS.pack(last_access))
+            strings.write(p)
+            strings.write(name)
+            offset += len(p) + len(name)
+            for gram in set(trigrams(name)):
+                ids = grams.get(gram)
+                if ids is None:
+                    ids = grams[gram] = array('I')
+                ids.append(n)
+            n += 1
+    finally:
+        conn.close()
+
+    paths_off = HEADER.size
+    names_off = paths_off + n * SPAN.size
+    freq_off = names_off + n * SPAN.size
+    access_off = freq_off + n * FREQUENCY.size
+    strings_off = access_off + n * ACCESS.size
+    trigrams_off = strings_off + offset
+    postings_off = trigrams_off + len(grams) * TRIGRAM.size
+
+    header = HEADER.pack(MAGIC, db_mtime, n, len(grams), paths_off,
+                         names_off, freq_off, access_off, strings_off,
+                         trigrams_off, postings_off)
+
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            section.seek(0)
+            shutil.copyfileobj(section, f)
+            section.close()
+        count = 0
+        for gram in sorted(grams):
+            f.write(TRIGRAM.pack(gram, count, len(grams[gram])))
+            count += len(grams[gram])
+        for gram in sorted(grams):
+            ids = grams[gram]
+            if sys.byteorder != 'little':
+                ids.byteswap()
+            f.write(ids.tostring())
+    os.rename(tmp, path)
+
+
+def trigrams(s):
+    """To yield the trigrams of the given byte string as integers."""
+    for i in xrange(len(s) - 2):
+        yield ord(s[i]) << 16 | ord(s[i + 1]) << 8 | ord(s[i + 2])
+
+
+class FrozenIndex:
+
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.stamp = None
+        self.header = None
+
+    def close(self):
+        """To unmap the snapshot."""
+        if self.map:
+            self.map.close()
+        self.map = self.stamp = self.header = None
+
+    def open(self):
+        """To map the snapshot, again if it has been rebuilt in the
+        meantime. False is returned if there is no valid snapshot."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self.close()
+            return False
+
+        stamp = (st.st_ino, st.st_mtime, st.st_size)
+        if stamp != self.stamp:
+            # lookups still running on the old map keep it alive
+            self.map = self.stamp = self.header = None
+            if st.st_size < HEADER.size:
+                return False
+            with open(self.path, 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            header = HEADER.unpack_from(m, 0)
+            if header[0] != MAGIC:
+                m.close()
+                return False
+            self.map, self.stamp, self.header = m, stamp, header
+
+        return True
+
+    def fresh(self, db_path):
+        """To check whether the snapshot reflects the current content of
+        the database."""
+        try:
+            return (self.open()
+                    and self.header[1] == os.stat(db_path).st_mtime)
+        except OSError:
+            return False
+
+    def get(self, target, exclude=None, case_sensitive=False):
+        """To get all rows matching the query 'target' (see
+        ozzy.db.split_query), along with the position of the match.
+        Candidates are looked up by the trigrams of their case-folded name
+        in both modes, then the other tokens are checked against the name
+        and the directory of each candidate. None is returned when the
+        database would be faster (see SELECTIVITY)."""
+        m = self.map
+        n, ntrigrams, trigrams_off, postings_off = (
+            self.header[2], self.header[3], self.header[9], self.header[10])
+
+        folded = ozzy.db.fold(ozzy.db.split_query(target)[1]).encode('utf-8')
+        if len(folded) < 3:
+            return None
+
+        # (postings count, postings offset) of each trigram
+        lists = []
+        for gram in set(trigrams(folded)):
+            entry = self._find_trigram(m, gram, ntrigrams, trigrams_off)
+            if entry is None:
+                return iter([])
+            lists.append((entry[1], postings_off + entry[0] * POSTING.size))
+        lists.sort()
+        if lists[0][0] * SELECTIVITY > n:
+            return None
+
+        return self._rows(m, target, folded, lists, exclude, case_sensitive)
+
+    def _rows(self, m, target, folded, lists, exclude, case_sensitive):
+        """To yield the rows matching the query among the records that
+        contain all the trigrams of its file name token."""
+        (_, _, n, ntrigrams, paths_off, names_off, freq_off, access_off,
+         strings_off, trigrams_off, postings_off) = self.header
+
+        others, target = ozzy.db.split_query(target)
+        if not case_sensitive:
+            others = [ozzy.db.fold(token) for token in others]
+        folded_dirs = {}
+
+        if exclude:
+            exclude = exclude.decode('utf-8')
+
+        for i in self._lookup(m, lists):
+
+            offset, length = SPAN.unpack_from(m, names_off + i * SPAN.size)
+            offset += strings_off
+            name = m[offset:offset + length]
+            pos = name.find(folded)
+            if pos < 0:
+                continue
+
+            offset, length = SPAN.unpack_from(m, paths_off + i * SPAN.size)
+            offset += strings_off
+            path = m[offset:offset + length].decode('utf-8')
+            if path == exclude:
+                continue
+
+            fname = os.path.basename(path)
+            if case_sensitive:
+                pos = fname.find(target)
+                if pos < 0:
+                    continue
+            else:
+                # from a byte offset to a character offset
+                pos = len(name[:pos].decode('utf-8'))
+
+            dirname = os.path.dirname(path)
+            if others:
+                if case_sensitive:
+                    matched = ozzy.db.match_tokens(others, fname, dirname)
+                else:
+                    folded_dir = folded_dirs.get(dirname)
+                    if folded_dir is None:
+                        folded_dir = folded_dirs[dirname] = \
+                            ozzy.db.fold(dirname)
+                    matched = ozzy.db.match_tokens(
+                        others, ozzy.db.fold(fname), folded_dir)
+                if not matched:
+                    continue
+
+            yield ozzy.db.Row(
+                path, fname,
+                FREQUENCY.unpack_from(m, freq_off + i * FREQUENCY.size)[0],
+                ACCESS.unpack_from(m, access_off + i * ACCESS.size)[0],
+                pos + 1, dirname)
+
+    def _lookup(self, m, lists):
+        """To yield the records that are in all the given posting lists,
+        sorted by length (the shortest one drives)."""
+        (count, start), others = lists[0], lists[1:]
+        for k in xrange(count):
+            i = POSTING.unpack_from(m, start + k * POSTING.size)[0]
+            if all(self._contains(m, o, c, i) for c, o in others):
+                yield i
+
+    def _find_trigram(self, m, gram, ntrigrams, trigrams_off):
+        """To find the (postings offset, postings count) of a trigram."""
+        lo, hi = 0, ntrigrams
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key, offset, count = TRIGRAM.unpack_from(
+                m, trigrams_off + mid * TRIGRAM.size)
+            if key < gram:
+                lo = mid + 1
+            elif key > gram:
+                hi = mid
+            else:
+                return offset, count
+        return None
+
+    def _contains(self, m, start, count, i):
+        """To check whether a posting list contains the given record."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = POSTING.unpack_from(m, start + mid * POSTING.size)[0]
+            if value < i:
+                lo = mid + 1
+            elif value > i:
+                hi = mid
+            else:
+                return True
+        return False
+
+
+def main(argv):
+    build(argv[1], argv[2])
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -20,30 +20,25 @@ class Input:
         self.RETURN = self.ESC = self.TAB = None
         self.MOUSE = self.CTRL = self.INTERRUPT = None
         self.CHAR = None
-        vim.command("let g:_pse_launcher_char = ''")
-        vim.command("let g:_pse_launcher_interrupt = 0")
+
+    def pending(self):
+        """To check whether the user has pressed a key, without consuming
+        it."""
+        return vim.eval('getchar(1)') != '0'
 
     def get(self):
-        """To read the key pressed by the user."""
+        """To read the key pressed by the user. The key is read and decoded
+        by the OzzyGetKey vim function (see plugin/ozzy.vim)."""
         self.reset()
 
-        vim.command("""
-            try |
-             let g:_pse_launcher_char = getchar() |
-            catch |
-             let g:_pse_launcher_interrupt = 1 |
-            endtry
-        """)
+        nr, char = vim.eval('OzzyGetKey()')
+        nr = int(nr)
 
-        if vim.eval('g:_pse_launcher_interrupt') == '1': # Ctrl + c
+        if nr < 0: # Ctrl + c
             self.CTRL = True
             self.CHAR = 'c'
             self.INTERRUPT = True
             return
-        else:
-            nr_char = vim.eval('g:_pse_launcher_char')
-
-        nr = int(vim.eval("str2nr('{0}')".format(nr_char)))
 
         if nr != 0:
 
@@ -55,14 +50,14 @@ class Input:
                 self.TAB = True
             elif 1 <= nr <= 26:
                 self.CTRL = True
-                self.CHAR = vim.eval("nr2char({0})".format(nr + 96))
+                self.CHAR = char
             else:
-                self.CHAR = vim.eval("nr2char({0})".format(nr))
+                self.CHAR = char
 
         else:
 
-            # Remove the first character 0x80
-            c = vim.eval("strpart('{0}', 1)".format(nr_char))
+            # special key, without the first character 0x80
+            c = char
             if c == 'kl':
                 self.LEFT = True
             elif c == 'kr':
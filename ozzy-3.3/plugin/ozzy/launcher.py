@@ -11,7 +11,7 @@ from __future__ import division
 import os
 import re
 import vim
-from math import *
+import math
 
 import ozzy.input
 import ozzy.utils.misc
@@ -37,7 +37,20 @@ class Launcher:
         self.mapper = {}
         self.orig_settings = {}
         self.max_entries = self.settings.get('max_entries', int)
-        self.RE_MATH = re.compile('(\d+|\+|\*|\/|-)')
+        self.input = None
+        self.worker_seed = None
+        self.worker_results = None
+        self.last_scoreboard = []
+        self.home = os.path.realpath(os.path.expanduser('~'))
+
+        # an arithmetic expression is made of numbers and names from the
+        # math module only, with at least an operator or a parenthesis
+        self.MATH = dict((name, getattr(math, name)) for name in dir(math)
+                         if not name.startswith('_'))
+        self.RE_MATH = re.compile(r'^[\w\s.,+\-*/%()]+$')
+        self.RE_MATH_OPERATOR = re.compile(r'[-+*/%()]')
+        self.RE_MATH_OPERAND = re.compile(r'\d|[A-Za-z_]')
+        self.RE_MATH_NAME = re.compile(r'\b[A-Za-z_]\w*')
 
         # setup highlight groups
         self.setup_colors()
@@ -81,6 +94,9 @@ class Launcher:
         self.curr_entries_number = 0
         self.curr_file = None
         self.mapper = {}
+        self.worker_seed = None
+        self.worker_results = None
+        self.last_scoreboard = []
 
     def setup_buffer(self):
         """To setup buffer properties of the matches list window."""
@@ -109,9 +125,12 @@ class Launcher:
     def highlight(self, max_len, input):
         vim.command("syntax clear")
         vim.command('syn match OzzyPaths /\%>{0}c./'.format(max_len + 3))
-        if input:
-            vim.command("syn match OzzyMatches /\%<{0}v\c{1}/".format(
-                max_len + 2, input.encode('utf-8', 'ignore')))
+        for token in input.split():
+            # tokens are matched literally (very nomagic)
+            token = token.encode('utf-8', 'ignore')
+            token = token.replace('\\', '\\\\').replace('/', '\\/')
+            vim.command("syn match OzzyMatches /\%<{0}v\c\V{1}/".format(
+                max_len + 2, token))
 
     def close_launcher(self):
         """To close the matches list window."""
@@ -150,51 +169,102 @@ class Launcher:
             vim.current.window.height = 1
             self.curr_pos = 0
 
-        else:
-
-            scoreboard = self.data.make_scoreboard(
-                self.input_so_far, exclude=self.curr_file)
-            data = [path for score, path in sorted(scoreboard, reverse=True)]
+        elif self.data.use_worker():
 
-            if data:
+            # The search worker is asked for new matches only when the input
+            # changes. In the meantime the last results received are displayed
+            if self.input_so_far != self.worker_seed:
+                self.worker_seed = self.input_so_far
+                self.data.request_scoreboard(
+                    self.input_so_far, exclude=self.curr_file,
+                    limit=self.max_entries)
+            self.display_matches(self.worker_results)
 
-                data = data[-self.max_entries:]
-                m = max(len(os.path.basename(path)) for path in data)
-                self.mapper = dict(enumerate(data))
-                self.misc.set_buffer([self.format_record(p, m) for p in data])
-                vim.current.window.height = len(data)
-                self.highlight(m, self.input_so_far)
-                self.format_curr_line(m)
+        else:
 
+            # Scoring is abandoned as soon as the user types something else
+            # and the (partial) results computed so far are displayed.
+            # Matches from the history are displayed first, then those from
+            # slower providers are merged in as they come. Unless the user
+            # has moved the selection, each list is shown with its best
+            # match selected. If the search is abandoned before any match
+            # is scored, the previous matches are displayed again.
+            selected = self.curr_pos
+            scoreboard = None
+            scoreboards = self.data.make_scoreboards(
+                self.input_so_far, exclude=self.curr_file,
+                limit=self.max_entries, interrupt=self.input.pending)
+            for i, scoreboard in enumerate(scoreboards):
+                if i:
+                    self.place_cursor()
+                    self.curr_pos = selected
+                    self.misc.redraw()
+                    self.echo_prompt()
+                self.display_matches(scoreboard)
+            if scoreboard is None:
+                self.display_matches(self.last_scoreboard)
             else:
+                self.last_scoreboard = scoreboard
 
-                vim.command('syntax clear')
-                self.misc.set_buffer([' nothing found...'])
-                vim.current.window.height = 1
-                self.curr_pos = 0
+        self.place_cursor()
 
+    def place_cursor(self):
+        """To move the cursor on the selected match."""
         if self.curr_pos is not None:
             vim.current.window.cursor = (self.curr_pos + 1, 1)
         self.curr_entries_number = vim.current.window.height
 
         vim.command("normal! 0")
 
+    def display_matches(self, scoreboard):
+        """To display the best matches of the given scoreboard. None means
+        that the matches are still being searched."""
+        if scoreboard is None:
+            vim.command('syntax clear')
+            self.misc.set_buffer([' searching...'])
+            vim.current.window.height = 1
+            self.curr_pos = 0
+            return
+
+        data = [path for score, path in sorted(scoreboard, reverse=True)]
+
+        if data:
+
+            data = data[-self.max_entries:]
+            m = max(len(os.path.basename(path)) for path in data)
+            self.mapper = dict(enumerate(data))
+            self.misc.set_buffer([self.format_record(p, m) for p in data])
+            vim.current.window.height = len(data)
+            self.highlight(m, self.input_so_far)
+            self.format_curr_line(m)
+
+        else:
+
+            vim.command('syntax clear')
+            self.misc.set_buffer([' nothing found...'])
+            vim.current.window.height = 1
+            self.curr_pos = 0
+
     def is_arithmetic_expr(self, expr):
-        """To detect an arithmetic expression (very naive)."""
-        if self.RE_MATH.search(expr):
-            return True
+        """To detect an arithmetic expression. Anything else, such as
+        'test util' or 'file2', is a search."""
+        return bool(self.RE_MATH.match(expr)
+                    and self.RE_MATH_OPERATOR.search(expr)
+                    and self.RE_MATH_OPERAND.search(expr)
+                    and all(name in self.MATH
+                            for name in self.RE_MATH_NAME.findall(expr)))
 
     def eval_arithmetic_expr(self, expr):
         """To evaluate an arithmetic expression."""
         try:
-            return eval(expr)
+            return eval(expr, {'__builtins__': {}}, self.MATH)
         except:
             return None
 
     def format_record(self, path, max_len):
         """To format a match displayed in the matches list window."""
         path = path.encode('utf-8')
-        path = path.replace(os.path.realpath(os.path.expanduser('~')), '~')
+        path = path.replace(self.home, '~')
 
         if self.settings.get("show_file_names", bool):
             full_path = path
@@ -224,6 +294,20 @@ class Launcher:
             path = os.path.join(os.path.expanduser('~'), path[2:])
 
         self.data.delete_file(path)
+        # the search worker has to be asked for the matches again
+        self.worker_seed = None
+
+    def echo_prompt(self):
+        """To display the prompt and the text the user has typed so far."""
+        if self.plug.mode:
+            mode = self.settings.get('project_mode_flag')
+        else:
+            mode = self.settings.get('global_mode_flag')
+
+        prompt = """{0}{1}{2}""".format(
+            mode, self.prompt, self.input_so_far.encode('utf-8'))
+        prompt = prompt.replace("\\", "\\\\").replace('"', '\\"')
+        vim.command("echo \"{0}\"".format(prompt))
 
     def open(self):
         """To open the launcher."""
@@ -232,25 +316,31 @@ class Launcher:
         self.curr_file = vim.current.buffer.name
         self.curr_win = self.misc.winnr()
 
+        self.input = ozzy.input.Input()
+
         # This first call opens the list of matches even though the user
         # didn't give any character as input
         self.update_launcher()
         self.misc.redraw()
 
-        input = ozzy.input.Input()
+        input = self.input
         # Start the input loop
         while True:
 
-            if self.plug.mode:
-                mode = self.settings.get('project_mode_flag')
-            else:
-                mode = self.settings.get('global_mode_flag')
-
-            # Display the prompt and the text the user has been typed so far
-            prompt = """{0}{1}{2}""".format(
-                mode, self.prompt, self.input_so_far.encode('utf-8'))
-            prompt = prompt.replace("\\", "\\\\").replace('"', '\\"')
-            vim.command("echo \"{0}\"".format(prompt))
+            self.echo_prompt()
+
+            # While waiting for the next key, display the matches sent back
+            # by the search worker, until the last request is answered
+            while (self.data.use_worker() and self.data.waiting_scoreboard()
+                   and not input.pending()):
+                results = self.data.poll_scoreboard()
+                if results is not None:
+                    self.worker_results = results
+                    self.curr_pos = None
+                    self.update_launcher()
+                    self.misc.redraw()
+                    self.echo_prompt()
+                vim.command('sleep 10m')
 
             # Get the next character
             input.get()
@@ -259,7 +349,6 @@ class Launcher:
                 or input.CTRL and input.CHAR == 'e'):
                 # The user have chosen the currently selected match
                 self.open_selected_file()
-                self.data.cache = []
                 break
 
             elif input.BS:
@@ -268,12 +357,10 @@ class Launcher:
                 # Reset the position of the selection in the matches list
                 # because the list has to be rebuilt
                 self.curr_pos = None
-                self.data.cache = []
 
             elif input.ESC or input.INTERRUPT:
                 # The user want to close the launcher
                 self.close_launcher()
-                self.data.cache = []
                 self.misc.redraw()
                 break
 
@@ -296,13 +383,11 @@ class Launcher:
             elif input.CTRL and input.CHAR == 'd':
                 self.delete_selected_file()
                 self.curr_pos = None
-                self.data.cache = []
 
             elif input.CTRL and input.CHAR == 'u':
                 # clear the current search
                 self.input_so_far = ''
                 self.curr_pos = None
-                self.data.cache = []
 
             elif input.CHAR:
                 # A printable character has been pressed. We have to remember
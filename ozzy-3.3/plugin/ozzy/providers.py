@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+ozzy.providers
+~~~~~~~~~~~~~~
+
+This module defines the providers of candidates that are not in the files
+index, such as the listed buffers or the files tracked by git. Each one
+caches its candidates until a cheap signal tells that they have changed.
+"""
+
+import os
+import vim
+import subprocess
+
+import ozzy.db
+import ozzy.utils.misc
+
+
+class BuffersProvider:
+    """Candidates are the currently listed buffers."""
+
+    def __init__(self):
+        self.signal = None
+        self.candidates = []
+
+    def lookup(self, seed, exclude, cwd, root, ignore_case):
+        """To return the candidates that match the seed."""
+        # the candidates are read again only when buffers are added or
+        # removed from the buffer list
+        signal = vim.eval("bufnr('$') . ':' . "
+                          "len(filter(range(1, bufnr('$')), 'buflisted(v:val)'))")
+        if signal != self.signal:
+            names = vim.eval("map(filter(range(1, bufnr('$')), "
+                             "'buflisted(v:val) && bufname(v:val) != \"\"'), "
+                             "'fnamemodify(bufname(v:val), \":p\")')")
+            self.candidates = _candidates(names)
+            self.signal = signal
+
+        return _filter(self.candidates, seed, exclude, ignore_case)
+
+
+class GitProvider:
+    """Candidates are the files tracked by git in the current repository."""
+
+    def __init__(self):
+        # repository root -> (mtime of the git index, candidates)
+        self.cache = {}
+
+    def lookup(self, seed, exclude, cwd, root, ignore_case):
+        """To return the candidates that match the seed."""
+        top = root or ozzy.utils.misc.find_root(cwd, ['.git'])
+        if not top:
+            return []
+
+        # the list of files is read again only when the git index changes
+        try:
+            mtime = os.stat(os.path.join(top, '.git', 'index')).st_mtime
+        except OSError:
+            return []
+
+        cached = self.cache.get(top)
+        if not cached or cached[0] != mtime:
+            cached = (mtime, _candidates(self._ls_files(top)))
+            self.cache[top] = cached
+
+        return _filter(cached[1], seed, exclude, ignore_case)
+
+    def _ls_files(self, top):
+        """To return the files tracked by git under the given directory."""
+        try:
+            p = subprocess.Popen(['git', 'ls-files', '-z'], cwd=top,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+            out, err = p.communicate()
+        except OSError:
+            return []
+        if p.returncode != 0:
+            return []
+        return [os.path.join(top, name) for name in out.split('\0') if name]
+
+
+def _candidates(paths):
+    """To turn a list of paths into rows along with their case-folded file
+    names. Candidates have never been opened, so their frequency and last
+    access time are zero."""
+    rows = []
+    for path in paths:
+        try:
+            path = path.decode('utf-8')
+        except UnicodeDecodeError:
+            continue
+        fname = os.path.basename(path)
+        rows.append((ozzy.db.fold(fname), ozzy.db.Row(path, fname, 0, 0)))
+    return rows
+
+
+def _filter(candidates, seed, exclude, ignore_case):
+    """To return the candidates matching the seed (see
+    ozzy.db.split_query), along with the position of the match."""
+    if exclude:
+        exclude = exclude.decode('utf-8')
+    others, seed = ozzy.db.split_query(seed)
+    if ignore_case:
+        seed = ozzy.db.fold(seed)
+        others = [ozzy.db.fold(token) for token in others]
+    folded_dirs = {}
+    rows = []
+    for fname, r in candidates:
+        if not ignore_case:
+            fname = r.fname
+        pos = fname.find(seed)
+        if pos < 0 or r.path == exclude:
+            continue
+        if others:
+            dirname = r.dirname
+            if ignore_case:
+                dirname = folded_dirs.get(r.dirname)
+                if dirname is None:
+                    dirname = folded_dirs[r.dirname] = ozzy.db.fold(r.dirname)
+            if not ozzy.db.match_tokens(others, fname, dirname):
+                continue
+        rows.append(ozzy.db.Row(r.path, r.fname, 0, 0, pos + 1, r.dirname))
+    return rows
+
+
+providers = {
+    'buffers': BuffersProvider,
+    'git': GitProvider,
+}
@@ -11,6 +11,8 @@ import os
 import vim
 from itertools import izip
 
+from ozzy.utils.paths import distance
+
 
 def echom(msg):
     """Display a simple feedback to the user via the command line."""
@@ -68,30 +70,3 @@ def find_root(path, root_markers):
         return path
     else:
         return find_root(os.path.dirname(path), root_markers)
-
-
-def distance(start, dest):
-    """To find the distance (in directory tree levels) between two
-    directories."""
-    sep = os.path.sep
-
-    if dest.startswith(start):
-        # 'dest' is a subdirectory of 'start' so we just count the
-        # number of directories between them ('dest' included)
-        p = dest.replace(start, '')
-        return len(p.split(sep)[1:])
-
-    else:
-        # from paths to lists
-        start_lst = start.strip(sep).split(sep)
-        dest_lst = dest.strip(sep).split(sep)
-
-        for d1, d2 in zip(start_lst, dest_lst):
-            if d1 == d2:
-                # remove common ancestor
-                start_lst.remove(d1)
-                dest_lst.remove(d1)
-            else:
-                break
-
-        return len(start_lst) + len(dest_lst) - 2
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+ozzy.utils.paths
+~~~~~~~~~~~~~~~~
+
+This module defines various utility functions for dealing with paths.
+Unlike ozzy.utils.misc, it does not depend on vim so that it can be used
+by the search worker too.
+"""
+
+import os
+
+
+def distance(start, dest):
+    """To find the distance (in directory tree levels) between two
+    directories."""
+    sep = os.path.sep
+
+    if dest.startswith(start):
+        # 'dest' is a subdirectory of 'start' so we just count the
+        # number of directories between them ('dest' included)
+        p = dest.replace(start, '')
+        return len(p.split(sep)[1:])
+
+    else:
+        # from paths to lists
+        start_lst = start.strip(sep).split(sep)
+        dest_lst = dest.strip(sep).split(sep)
+
+        for d1, d2 in zip(start_lst, dest_lst):
+            if d1 == d2:
+                # remove common ancestor
+                start_lst.remove(d1)
+                dest_lst.remove(d1)
+            else:
+                break
+
+        return len(start_lst) + len(dest_lst) - 2
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+ozzy.worker
+~~~~~~~~~~~
+
+This module defines the search worker, a separate python process that
+answers the requests sent by vim over a channel, so that slow queries
+never freeze the editor. Requests and replies are JSON messages, one per
+line:
+
+    {"id": 1, "method": "make_scoreboard", "params": {...}}
+    {"id": 1, "result": [[score, path], ...], "complete": true}
+
+Usage: python worker.py <database path> <engine options as JSON>
+"""
+
+import os
+import sys
+import json
+import heapq
+import select
+
+if __name__ == '__main__':
+    # make the ozzy package importable
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import ozzy.engine
+
+
+class Requests:
+    """Line reader for the incoming requests that can tell whether a new
+    request is waiting without blocking."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = ''
+
+    def pending(self):
+        """To check whether another request is waiting."""
+        if '\n' in self.buffer:
+            return True
+        return bool(select.select([self.fd], [], [], 0)[0])
+
+    def next(self):
+        """To return the next request, or None when the input is closed."""
+        while '\n' not in self.buffer:
+            data = os.read(self.fd, 65536)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split('\n', 1)
+        return line
+
+
+class Worker:
+
+    def __init__(self, engine, requests, out):
+        self.engine = engine
+        self.requests = requests
+        self.out = out
+
+    def serve(self):
+        """To answer requests until the input is closed."""
+        while True:
+
+            line = self.requests.next()
+            if line is None:
+                break
+
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+
+            reply = {'id': msg.get('id')}
+            try:
+                reply.update(self.handle(msg.get('method'),
+                                         msg.get('params', {})))
+            except Exception as e:
+                reply['error'] = str(e)
+
+            self.out.write(json.dumps(reply) + '\n')
+            self.out.flush()
+
+        self.engine.close()
+
+    def handle(self, method, params):
+        """To execute a single request."""
+        if method == 'make_scoreboard':
+            # the query is abandoned as soon as a new request comes in
+            results, complete = self.engine.make_scoreboard(
+                params['seed'], _encode(params.get('exclude')),
+                _encode(params['cwd']), _encode(params.get('root')),
+                params.get('ignore_case', True), params.get('limit'),
+                params.get('sql_ranking', False), self.requests.pending)
+            # only the matches actually displayed are sent back
+            if results is not None and params.get('limit'):
+                results = heapq.nsmallest(params['limit'], results)
+            return {'result': results, 'complete': complete}
+
+        elif method == 'update_file':
+            self.engine.update_file(_encode(params['path']))
+
+        elif method == 'delete_files':
+            self.engine.delete_files(params['paths'])
+
+        elif method == 'clear_index':
+            self.engine.clear_index()
+
+        else:
+            raise ValueError("unknown method '{0}'".format(method))
+
+        return {}
+
+
+def _encode(s):
+    """Paths are handed to the engine as utf-8 encoded strings, just like
+    vim does."""
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+def main(argv):
+    db_path, options = argv[1], json.loads(argv[2])
+    engine = ozzy.engine.Engine(
+        db_path, **dict((str(k), v) for k, v in options.items()))
+    Worker(engine, Requests(sys.stdin.fileno()), sys.stdout).serve()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -9,6 +9,7 @@ This module defines the main Ozzy class.
 import os
 import vim
 import sys
+import json
 
 sys.path.insert(0, os.path.dirname(
     vim.eval('globpath(&runtimepath, "plugin/ozzy.py")')))
@@ -118,6 +119,30 @@ class Ozzy(object):
         """To open the launcher."""
         self.launcher.open()
 
+    @exec_if_valid_state
+    def Explain(self, as_json=False):
+        """To show how the best matches for a query are ranked."""
+        seed = vim.eval('g:_ozzy_explain_query').decode('utf-8')
+        report = self.data.explain(seed, exclude=vim.current.buffer.name,
+                                   limit=self.settings.get('max_entries', int))
+
+        if as_json:
+            print json.dumps(report, indent=2)
+            return
+
+        t = report['timings']
+        print ("{0} matches for '{1}' (fetch {2:.1f}ms, stat {3:.1f}ms, "
+               "score {4:.1f}ms)".format(
+                   report['matches'], seed.encode('utf-8'),
+                   t['fetch'] * 1000, t['stat'] * 1000, t['score'] * 1000))
+        print "{0:>7}{1:>7}{2:>7}{3:>7}{4:>7}  {5}".format(
+            'score', 'freq', 'time', 'dist', 'pos', 'path')
+        home = os.path.realpath(os.path.expanduser('~'))
+        for d in report['results']:
+            print "{0:>7.3f}{1:>7.3f}{2:>7.3f}{3:>7.3f}{4:>7.3f}  {5}".format(
+                d['score'], d['freq_norm'], d['time_norm'], d['dist_norm'],
+                d['pos_norm'], d['path'].encode('utf-8').replace(home, '~'))
+
     @exec_if_valid_state
     def Reset(self):
         """To clear the entire database."""
@@ -24,12 +24,20 @@ let g:ozzy_ignore = get(g:, 'ozzy_ignore', [])
 let g:ozzy_track_only = get(g:, 'ozzy_track_only', [])
 let g:ozzy_prompt = get(g:, 'ozzy_prompt', '>> ')
 let g:ozzy_max_entries = get(g:, 'ozzy_max_entries', 15)
+let g:ozzy_cache_size = get(g:, 'ozzy_cache_size', 64)
 let g:ozzy_default_mode = get(g:, 'ozzy_default_mode', 0)
 let g:ozzy_show_file_names = get(g:, 'ozzy_show_file_names', 0)
 let g:ozzy_ignore_case = get(g:, 'ozzy_ignore_case', 1)
 let g:ozzy_global_mode_flag = get(g:, 'ozzy_global_mode_flag', '')
 let g:ozzy_project_mode_flag = get(g:, 'ozzy_project_mode_flag', '')
 let g:ozzy_root_markers = get(g:, 'ozzy_root_markers', ['.git', '.svn', '.hg', 'AndroidManifest.xml'])
+let g:ozzy_sql_ranking = get(g:, 'ozzy_sql_ranking', 0)
+let g:ozzy_worker = get(g:, 'ozzy_worker', 0)
+let g:ozzy_worker_python = get(g:, 'ozzy_worker_python', 'python')
+let g:ozzy_providers = get(g:, 'ozzy_providers', [])
+let g:ozzy_frozen_index = get(g:, 'ozzy_frozen_index', 0)
+let g:ozzy_busy_timeout = get(g:, 'ozzy_busy_timeout', 200)
+let g:ozzy_write_retries = get(g:, 'ozzy_write_retries', 3)
 let g:ozzy_paths_color = get(g:, 'ozzy_paths_color', 'gui=NONE guifg=#777777 cterm=NONE ctermfg=242')
 let g:ozzy_paths_color_darkbg = get(g:, 'ozzy_paths_color_darkbg', '')
 let g:ozzy_matches_color = get(g:, 'ozzy_matches_color', 'gui=bold guifg=#ff6155 cterm=bold ctermfg=203')
@@ -38,6 +46,23 @@ let g:ozzy_last_dir_color = get(g:, 'ozzy_last_dir_color', 'gui=bold cterm=bold'
 let g:ozzy_last_dir_color_darkbg = get(g:, 'ozzy_last_dir_color_darkbg', '')
 
 
+" Input
+" To read a key and decode it at once, so that python needs a single call.
+" A [code, char] list is returned: for special keys the code is 0 and char is
+" the key name (without the leading 0x80 byte), for CTRL-C the code is -1.
+function! OzzyGetKey()
+    try
+        let c = getchar()
+    catch
+        return [-1, '']
+    endtry
+    if type(c) == type('')
+        return [0, strpart(c, 1)]
+    endif
+    return [c, nr2char(1 <= c && c <= 26 ? c + 96 : c)]
+endfunction
+
+
 " Create the plugin object
 let py_module = fnameescape(globpath(&runtimepath, 'plugin/ozzy.py'))
 exe 'pyfile ' . py_module
@@ -48,6 +73,7 @@ python ozzy_plugin = Ozzy()
 command! Ozzy py ozzy_plugin.Open()
 command! OzzyReset py ozzy_plugin.Reset()
 command! OzzyToggleMode py ozzy_plugin.ToggleMode()
+command! -nargs=? -bang OzzyExplain let g:_ozzy_explain_query = <q-args> | py ozzy_plugin.Explain('<bang>' == '!')
 
 
 " Autocommands